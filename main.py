@@ -1,125 +1,613 @@
-from os.path import basename
 import subprocess
 import os
 import sys
 import argparse
 import re
+import errno
 import json
+import stat
+import hashlib
+import functools
+import threading
+import operator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from dataclasses import dataclass
 
-global _verbose, _ignore_binaries, _output_json
+try:
+    import pygit2  # Optional: in-process libgit2 backend
+except ImportError:
+    pygit2 = None
 
-_verbose = False
-_ignore_binaries = False
-_output_json = False
+try:
+    import orjson  # Optional: faster JSON encoding
+except ImportError:
+    orjson = None
 
 
-def _log_message(message, level="normal"):
+@dataclass(frozen=True, slots=True)
+class Config:
+    """
+    Run-wide options, built once from the command line and passed down
+    explicitly instead of being read from module globals.
+    """
+
+    verbose: bool = False
+    ignore_binaries: bool = False
+    json: bool = False
+    json_lines: bool = False  # With json: one compact object per line
+    pretty: bool = False  # With json: indent the array by 2 spaces
+    sort: bool = True
+    timeout: float | None = None  # Seconds before a Git command is aborted
+
+    @property
+    def debug_enabled(self):
+        """
+        True if debug messages are printed. Call sites check it before
+        building a debug message, so dropped messages are never formatted.
+        """
+        return self.verbose and not self.json
+
+
+# Serializes writes from worker threads so log lines do not interleave.
+_log_lock = threading.Lock()
+
+# Working-tree roots already confirmed by 'git rev-parse' in this process.
+_WORK_TREE_ROOTS = set()
+
+# Display form of each two-letter porcelain status code (e.g. b" M" -> "M"),
+# filled as codes are first seen.
+_STATUS_DISPLAY = {}
+
+# Matches each line that starts a new part of a 'git diff' output: the header
+# of a file section (group 1), the notice 'git diff --cached' prints instead of
+# a section for a conflicted file (group 2), or any other line that cannot
+# belong to a file section, such as stray text from a user's diff settings.
+_DIFF_SECTION_RE = re.compile(
+    rb"^(?:diff --git (.*)|\* Unmerged path (.*)|(?![ +\-@\\]|(?:index|old mode"
+    rb"|new mode|deleted file mode|new file mode|similarity index"
+    rb"|dissimilarity index|rename from|rename to|copy from|copy to"
+    rb"|Binary files) ).+)$",
+    re.MULTILINE,
+)
+# Extracts the path from an unquoted, non-renamed 'a/<path> b/<path>' header.
+_DIFF_HEADER_PATHS_RE = re.compile(rb"a/(.+) b/\1")
+# Matches one backslash escape inside a C-quoted path: octal byte or letter.
+_QUOTED_PATH_ESCAPE_RE = re.compile(rb"\\(?:([0-7]{3})|(.))", re.DOTALL)
+# Bytes behind the letter escapes Git uses when quoting paths.
+_QUOTED_PATH_ESCAPES = {
+    b"a": b"\a",
+    b"b": b"\b",
+    b"t": b"\t",
+    b"n": b"\n",
+    b"v": b"\v",
+    b"f": b"\f",
+    b"r": b"\r",
+}
+# Matches one byte Git escapes when quoting a path: control characters, '"',
+# backslash, DEL and (with core.quotePath, pinned below) non-ASCII bytes.
+_PATH_QUOTE_BYTE_RE = re.compile(rb'[\x00-\x1f"\\\x7f-\xff]')
+# Escapes Git uses for the bytes that have one; other bytes become octal.
+_PATH_QUOTE_ESCAPES = {
+    **{char: b"\\" + letter for letter, char in _QUOTED_PATH_ESCAPES.items()},
+    b'"': b'\\"',
+    b"\\": b"\\\\",
+}
+# Matches the start of each block of a diff: a file header or a hunk header.
+_HUNK_BOUNDARY_RE = re.compile(r"^(?:diff --git |@@ )", re.MULTILINE)
+
+# Options pinning the 'git diff' output format that the section split relies
+# on, whatever the user's diff.noPrefix, diff.mnemonicPrefix, color.diff,
+# diff.external or diff.submodule settings are.
+_DIFF_FORMAT_OPTIONS = [
+    "--src-prefix=a/",
+    "--dst-prefix=b/",
+    "--no-color",
+    "--no-ext-diff",
+    "--submodule=short",
+]
+
+# Number of paths passed to a single 'git diff' when diffing named files.
+_PATHSPEC_CHUNK_SIZE = 500
+
+# Flags for reading working-tree files as raw bytes without following
+# symlinks. O_NOFOLLOW is POSIX-only and O_BINARY Windows-only; where
+# O_NOFOLLOW is missing, symlinks are detected before the open instead.
+_NOFOLLOW_FLAG = getattr(os, "O_NOFOLLOW", 0)
+_WORKTREE_OPEN_FLAGS = os.O_RDONLY | _NOFOLLOW_FLAG | getattr(os, "O_BINARY", 0)
+
+# Environment for Git subprocesses: this tool only reads, so Git must not take
+# optional locks (e.g. to refresh the index) that other Git processes wait on.
+# The variable also reaches Git processes spawned by Git (e.g. for submodules).
+_GIT_ENV = {**os.environ, "GIT_OPTIONAL_LOCKS": "0"}
+# Prefix of every Git command line: never start a pager, never take optional
+# locks, and always quote non-ASCII paths, as untracked-file diffs do.
+_GIT_COMMAND = ["git", "--no-pager", "--no-optional-locks", "-c", "core.quotePath=true"]
+
+# Extensions treated as binary without looking at the file contents.
+_BINARY_EXTS = frozenset(
+    {
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".gif",
+        ".pdf",
+        ".zip",
+        ".tar",
+        ".gz",
+        ".so",
+        ".dylib",
+        ".dll",
+        ".exe",
+        ".class",
+        ".jar",
+        ".o",
+        ".a",
+        ".woff",
+        ".woff2",
+        ".ttf",
+        ".mp3",
+        ".mp4",
+        ".mkv",
+        ".ico",
+        ".webp",
+    }
+)
+
+
+def _log_message(cfg, message, level="normal"):
     """
     Internal logging function for the script.
     Only prints messages if verbose is enabled or if it's an error/warning.
     When JSON output is enabled, regular and debug messages are suppressed
     to keep stdout clean for JSON, but errors/warnings still go to stderr.
     """
-    if level == "error":
-        sys.stderr.write(f"Error: {message}\n")
-    elif level == "warning":
-        sys.stderr.write(f"Warning: {message}\n")
-    elif (
-        _verbose and not _output_json
-    ):  # Only print verbose messages if not outputting JSON
-        sys.stdout.write(f"{message}\n")
-    elif (
-        not _output_json and level == "info"
-    ):  # Info messages only if not outputting JSON
-        sys.stdout.write(f"{message}\n")
+    if level not in ("error", "warning") and (
+        cfg.json or (not cfg.verbose and level != "info")
+    ):
+        return  # Dropped before taking the lock or formatting any output
+
+    with _log_lock:
+        if level == "error":
+            sys.stderr.write(f"Error: {message}\n")
+        elif level == "warning":
+            sys.stderr.write(f"Warning: {message}\n")
+        else:
+            sys.stdout.write(f"{message}\n")
 
 
-def _execute_git_command(command_parts, cwd):
+def _execute_git_command_uncached(cfg, command_parts, cwd, input_data=None):
     """
     Executes a Git command and returns its stdout and a success boolean.
     Special handling for 'git diff' where exit code 1 means differences found (not an error).
+    If input_data (bytes) is given, it is written to the command's stdin.
+    The stdout is returned as the raw bytes Git wrote, without decoding or trimming.
     """
     cmd_str = "git " + " ".join(command_parts)
-    _log_message(f"Executing Git command: '{cmd_str}' in '{cwd}'", level="debug")
+    if cfg.debug_enabled:
+        _log_message(
+            cfg, f"Executing Git command: '{cmd_str}' in '{cwd}'", level="debug"
+        )
 
     is_diff_command = command_parts[0] == "diff"
 
     try:
         result = subprocess.run(
-            ["git"] + command_parts,
+            _GIT_COMMAND + command_parts,
             cwd=cwd,
+            env=_GIT_ENV,
+            input=input_data,
             capture_output=True,
-            text=True,
             check=False,
+            timeout=cfg.timeout,
         )
 
         if (
-            result.stdout and _verbose and not _output_json
+            result.stdout and cfg.debug_enabled
         ):  # Only log stdout if verbose and not JSON
-            _log_message(f"  Git STDOUT: {result.stdout.strip()}", level="debug")
-        if result.stderr:
-            _log_message(f"  Git STDERR: {result.stderr.strip()}", level="debug")
-
-        if is_diff_command and result.returncode == 1:
             _log_message(
-                f"Git diff finished with exit code 1 (differences found).",
+                cfg,
+                f"  Git STDOUT: {result.stdout.decode(errors='replace').strip()}",
                 level="debug",
             )
-            return result.stdout.strip(), True
+        if result.stderr and cfg.debug_enabled:
+            _log_message(
+                cfg,
+                f"  Git STDERR: {result.stderr.decode(errors='replace').strip()}",
+                level="debug",
+            )
+
+        if is_diff_command and result.returncode == 1:
+            if cfg.debug_enabled:
+                _log_message(
+                    cfg,
+                    f"Git diff finished with exit code 1 (differences found).",
+                    level="debug",
+                )
+            return result.stdout, True
 
         if result.returncode != 0:
             _log_message(
+                cfg,
                 f"Git command '{cmd_str}' failed with exit code {result.returncode}",
                 level="error",
             )
-            return result.stdout.strip(), False
+            return result.stdout, False
 
-        return result.stdout.strip(), True
+        return result.stdout, True
 
     except FileNotFoundError:
         _log_message(
+            cfg,
             "Git command not found. Ensure Git is installed and in your system's PATH.",
             level="error",
         )
-        return "", False
+        return b"", False
+    except subprocess.TimeoutExpired:
+        _log_message(
+            cfg,
+            f"Git command '{cmd_str}' timed out after {cfg.timeout} seconds.",
+            level="error",
+        )
+        return b"", False
     except Exception as e:
         _log_message(
+            cfg,
             f"An unexpected error occurred while running Git command '{cmd_str}': {e}",
             level="error",
         )
-        return "", False
+        return b"", False
 
 
-def _is_binary_file(file_path, repo_path):
+@functools.lru_cache(maxsize=None)
+def _cached_git_command(cfg, command_parts, cwd, input_data):
+    """Memoized runner behind _execute_git_command; command_parts is a tuple."""
+    return _execute_git_command_uncached(cfg, list(command_parts), cwd, input_data)
+
+
+def _execute_git_command(cfg, command_parts, cwd, input_data=None):
+    """
+    Same as _execute_git_command_uncached, but identical commands are only
+    run once per run_diff_logic call; later calls reuse the first result.
+    Commands whose output is large and read only once (the repo-wide diff)
+    should call _execute_git_command_uncached instead of keeping it alive.
+    """
+    return _cached_git_command(cfg, tuple(command_parts), cwd, input_data)
+
+
+def _stream_git_records(cfg, command_parts, cwd, result):
     """
-    Checks if a file is considered binary by Git.
-    Returns True if binary, False otherwise.
+    Runs a Git command whose output is NUL-terminated (-z) and yields each
+    record as bytes while the command is still running, reading its stdout
+    in 64KiB chunks instead of buffering the whole output.
+    Once the command has exited, result["success"] is set accordingly.
+    Stderr is only kept for debug output, and is then drained on a thread so
+    a chatty command cannot fill the pipe and stall both processes.
     """
-    _log_message(f"Checking if '{file_path}' is binary...", level="debug")
+    cmd_str = "git " + " ".join(command_parts)
+    if cfg.debug_enabled:
+        _log_message(
+            cfg, f"Executing Git command: '{cmd_str}' in '{cwd}'", level="debug"
+        )
+    result["success"] = False
+
+    try:
+        process = subprocess.Popen(
+            _GIT_COMMAND + command_parts,
+            cwd=cwd,
+            env=_GIT_ENV,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if cfg.debug_enabled else subprocess.DEVNULL,
+            bufsize=-1,
+        )
+    except FileNotFoundError:
+        _log_message(
+            cfg,
+            "Git command not found. Ensure Git is installed and in your system's PATH.",
+            level="error",
+        )
+        return
+
+    stderr_chunks = []
+    stderr_reader = None
+    if process.stderr is not None:
+        stderr_reader = threading.Thread(
+            target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True
+        )
+        stderr_reader.start()
 
-    temp_diff_output, success = _execute_git_command(
-        ["diff", "HEAD", "--", file_path], cwd=repo_path
+    timer = None
+    if cfg.timeout is not None:
+        # A hung command is killed, which ends its output and fails it.
+        timer = threading.Timer(cfg.timeout, process.kill)
+        timer.start()
+
+    try:
+        with process:
+            pending = b""
+            while True:
+                chunk = process.stdout.read(65536)
+                if not chunk:
+                    break
+                records = (pending + chunk).split(b"\0")
+                pending = records.pop()  # Incomplete record, finished by the next chunk
+                yield from records
+
+            if stderr_reader is not None:
+                stderr_reader.join()
+                stderr = b"".join(stderr_chunks)
+                if stderr:
+                    _log_message(
+                        cfg,
+                        f"  Git STDERR: {stderr.decode(errors='replace').strip()}",
+                        level="debug",
+                    )
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    if timer is not None and process.returncode < 0:
+        _log_message(
+            cfg,
+            f"Git command '{cmd_str}' timed out after {cfg.timeout} seconds.",
+            level="error",
+        )
+        return
+    if process.returncode != 0:
+        _log_message(
+            cfg,
+            f"Git command '{cmd_str}' failed with exit code {process.returncode}",
+            level="error",
+        )
+        return
+    result["success"] = True
+
+
+def _parse_porcelain_z(cfg, records):
+    """
+    Turns 'git status --porcelain=v1 -z' records into {"status", "path"}
+    entries in a single pass. Each record is 'XY <path>' with the two-letter
+    status at fixed offsets, so no splitting or unquoting is needed; when
+    either letter is R or C (rename/copy), the next record holds the source
+    path and is kept as "orig_path".
+    """
+    records = iter(records)
+    for record in records:
+        if len(record) < 4 or record[2:3] != b" ":
+            if cfg.debug_enabled:
+                _log_message(
+                    cfg, f"Skipping malformed status record: '{record}'", level="debug"
+                )
+            continue
+
+        code = record[:2]
+        status_code = _STATUS_DISPLAY.get(code)
+        if status_code is None:
+            status_code = _STATUS_DISPLAY[code] = code.decode().strip()
+        entry = {"status": status_code, "path": os.fsdecode(record[3:])}
+        if code[0] in b"RC" or code[1] in b"RC":
+            source = next(records, None)  # Source path of the rename/copy
+            if source is not None:
+                entry["orig_path"] = os.fsdecode(source)
+
+        yield entry
+
+
+def _iter_status_entries(cfg, repo_path, result, include_untracked=True):
+    """
+    Yields {"status", "path"} entries from 'git status --porcelain=v1 -z' as
+    they are read. result["success"] is set once the status command has exited.
+    With -uall, Git lists each untracked file (honouring .gitignore) instead
+    of collapsing new directories into a single 'dir/' entry; without
+    include_untracked, -uno skips the untracked-file scan altogether.
+    """
+    untracked_mode = "all" if include_untracked else "no"
+    records = _stream_git_records(
+        cfg,
+        ["status", "--porcelain=v1", "-z", f"--untracked-files={untracked_mode}"],
+        cwd=repo_path,
+        result=result,
     )
-    if (
-        not success
-        and "unknown revision or path not in the working tree" in temp_diff_output
-    ):
-        # If it's not a tracked file (e.g., untracked), try --no-index
-        temp_diff_output, success = _execute_git_command(
-            ["diff", "--no-index", "/dev/null", file_path], cwd=repo_path
+    return _parse_porcelain_z(cfg, records)
+
+
+def _has_binary_extension(file_path):
+    """
+    Returns True if the file name ends in one of the well-known binary
+    extensions, so it can be treated as binary without any I/O.
+    """
+    dot = file_path.rfind(".")
+    return dot > file_path.rfind("/") + 1 and file_path[dot:].lower() in _BINARY_EXTS
+
+
+def _diff_marks_binary(diff_content):
+    """
+    Returns True if a single file's 'git diff' output is Git's
+    'Binary files ... differ' line instead of a patch.
+    That line always ends the file's section, so only the last line is read.
+    """
+    if not diff_content.endswith(b" differ\n"):
+        return False
+    last_line_start = diff_content.rfind(b"\n", 0, -1) + 1
+    return diff_content.startswith(b"Binary files ", last_line_start)
+
+
+def _classify_binaries(cfg, file_paths, repo_path, allow_all_changes):
+    """
+    Decides which of the given tracked files are binary with
+    'git diff --numstat', where Git reports binary files as '-<TAB>-' instead
+    of line counts; the paths are passed in chunks, not one process per file.
+    Well-known binary extensions are settled before Git is asked.
+    Returns a dict mapping each path to True if binary, False otherwise,
+    or None if a Git command failed.
+    """
+    binaries = {fpath: True for fpath in file_paths if _has_binary_extension(fpath)}
+    file_paths = [fpath for fpath in file_paths if fpath not in binaries]
+
+    for start in range(0, len(file_paths), _PATHSPEC_CHUNK_SIZE):
+        chunk = file_paths[start : start + _PATHSPEC_CHUNK_SIZE]
+        command = _tracked_diff_command(
+            cfg, repo_path, allow_all_changes, [":(literal)" + fpath for fpath in chunk]
+        )
+        command[1:1] = ["--numstat", "-z"]
+        stdout_numstat, success_numstat = _execute_git_command(
+            cfg, command, cwd=repo_path
+        )
+        if not success_numstat:
+            return None
+
+        # Records are '<added>\t<deleted>\t<path>\0', or for a rename
+        # '<added>\t<deleted>\t\0<old path>\0<new path>\0'.
+        fields = iter(stdout_numstat.split(b"\0"))
+        for field in fields:
+            counts = field.split(b"\t", 2)
+            if len(counts) != 3:
+                continue
+            fpath = counts[2]
+            if not fpath:
+                next(fields, None)  # Old path of a rename
+                fpath = next(fields, b"")
+            binaries[os.fsdecode(fpath)] = counts[0] == b"-" and counts[1] == b"-"
+
+    for fpath in file_paths:
+        binaries.setdefault(fpath, False)
+    return binaries
+
+
+def _untracked_binary_attributes(cfg, file_paths, repo_path):
+    """
+    Reads the 'binary' and 'diff' attributes of the given untracked files
+    with a single 'git check-attr' call, the paths passed on stdin.
+    Returns a dict mapping each path whose attributes decide the question to
+    True (binary, or '-diff') or False ('diff' set: always shown as text);
+    other paths are left to the content check.
+    Returns None if the command failed.
+    """
+    stdout_attrs, success_attrs = _execute_git_command_uncached(
+        cfg,
+        ["check-attr", "-z", "--stdin", "binary", "diff"],
+        cwd=repo_path,
+        input_data=b"".join(os.fsencode(fpath) + b"\0" for fpath in file_paths),
+    )
+    if not success_attrs:
+        return None
+
+    # Records are '<path>\0<attribute>\0<value>\0'.
+    binaries = {}
+    fields = stdout_attrs.split(b"\0")
+    for start in range(0, len(fields) - 2, 3):
+        fpath, attribute, value = fields[start : start + 3]
+        if attribute == b"binary" and value == b"set":
+            binaries[os.fsdecode(fpath)] = True
+        elif attribute == b"diff" and value in (b"set", b"unset"):
+            binaries.setdefault(os.fsdecode(fpath), value == b"unset")
+    return binaries
+
+
+def _read_worktree_file(full_path):
+    """
+    Reads a working-tree file with raw descriptor calls: one open, one fstat
+    and reads sized from the fstat, normally one returning the whole file and
+    one confirming the end, with no buffered file object in between.
+    Symlinks are not followed; their target is the content.
+    Returns the content and the Git file mode, both as bytes.
+    """
+    if not _NOFOLLOW_FLAG and os.path.islink(full_path):
+        return os.fsencode(os.readlink(full_path)), b"120000"
+    try:
+        fd = os.open(full_path, _WORKTREE_OPEN_FLAGS)
+    except OSError as e:
+        # O_NOFOLLOW makes opening a symlink fail (ELOOP, or EMLINK on FreeBSD).
+        if e.errno not in (errno.ELOOP, errno.EMLINK) or not os.path.islink(full_path):
+            raise
+        return os.fsencode(os.readlink(full_path)), b"120000"
+
+    try:
+        file_stat = os.fstat(fd)
+        # Read until end of file: a read may return less than asked for (files
+        # over 2 GiB, network or FUSE file systems), and the file may have
+        # grown after the fstat.
+        chunks = []
+        size = file_stat.st_size + 1
+        while chunk := os.read(fd, size):
+            chunks.append(chunk)
+            size = max(size - len(chunk), 65536)
+        content = b"".join(chunks)
+    finally:
+        os.close(fd)
+    return content, b"100755" if file_stat.st_mode & stat.S_IXUSR else b"100644"
+
+
+def _untracked_file_diff(cfg, file_path, repo_path, is_binary=None):
+    """
+    Builds the diff of an untracked file against /dev/null in Python, in the
+    same format as 'git diff --no-index /dev/null <file>', without spawning Git.
+    is_binary, if not None, is the verdict of the file's attributes; otherwise
+    the content decides, as in Git.
+    Returns the diff as bytes and whether the file is binary, or (None, False)
+    if the file cannot be read.
+    """
+    try:
+        content, mode = _read_worktree_file(os.path.join(repo_path, file_path))
+    except OSError as e:
+        if cfg.debug_enabled:
+            _log_message(
+                cfg, f"Could not read untracked file '{file_path}': {e}", level="debug"
+            )
+        return None, False
+
+    blob_id = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+    path_bytes = os.fsencode(file_path)
+    old_name = _quote_git_path(b"a/" + path_bytes)
+    new_name = _quote_git_path(b"b/" + path_bytes)
+    diff_lines = [
+        b"diff --git %s %s" % (old_name, new_name),
+        b"new file mode %s" % mode,
+        b"index 0000000..%s" % blob_id[:7].encode(),
+    ]
+
+    if is_binary is None:
+        # Same heuristic as Git: a NUL byte in the first 8000 bytes means binary.
+        is_binary = b"\0" in content[:8000]
+    if is_binary:
+        diff_lines.append(b"Binary files /dev/null and %s differ" % new_name)
+    elif content:
+        missing_newline = not content.endswith(b"\n")
+        if not missing_newline:
+            content = content[:-1]
+        line_count = content.count(b"\n") + 1
+        # Like Git, terminate names containing spaces with a tab.
+        name_suffix = b"\t" if b" " in path_bytes else b""
+        diff_lines.append(b"--- /dev/null")
+        diff_lines.append(b"+++ " + new_name + name_suffix)
+        diff_lines.append(
+            b"@@ -0,0 +1 @@" if line_count == 1 else b"@@ -0,0 +1,%d @@" % line_count
         )
+        # Against /dev/null every line is an addition: one hunk, built in C.
+        diff_lines.append(b"+" + content.replace(b"\n", b"\n+"))
+        if missing_newline:
+            diff_lines.append(b"\\ No newline at end of file")
 
-    if (
-        success
-        and "Binary files " in temp_diff_output
-        and " differ" in temp_diff_output
-    ):
-        _log_message(f"'{file_path}' identified as binary.", level="debug")
-        return True
+    diff_lines.append(b"")  # Newline-terminated, like Git's own output
+    return b"\n".join(diff_lines), is_binary
 
-    _log_message(f"'{file_path}' not identified as binary.", level="debug")
-    return False
+
+def _iter_diff_hunks(diff_content):
+    """
+    Yields the blocks of a Git diff string one at a time, where each block is
+    either a file header or a diff hunk. Block boundaries are found with a
+    single regex scan and blocks are sliced from the original string.
+    """
+    block_start = 0
+    for boundary in _HUNK_BOUNDARY_RE.finditer(diff_content):
+        if boundary.start() > block_start:
+            # Drop the newline that ends the block, as splitlines() would
+            yield diff_content[block_start : boundary.start() - 1]
+        block_start = boundary.start()
+
+    last_block = diff_content[block_start:]
+    if last_block:
+        yield last_block[:-1] if last_block.endswith("\n") else last_block
 
 
 def _split_diff_into_hunks(diff_content):
@@ -129,266 +617,939 @@ def _split_diff_into_hunks(diff_content):
     """
     if not diff_content:
         return []
+    return list(_iter_diff_hunks(diff_content))
+
+
+def _unquote_git_path(raw_path):
+    """
+    Undoes the C-style quoting Git applies to paths with special characters
+    in diff headers ('"a/caf\\303\\251"'). Unquoted paths are returned as is.
+    """
+    if len(raw_path) < 2 or raw_path[:1] != b'"' or raw_path[-1:] != b'"':
+        return raw_path
+    return _QUOTED_PATH_ESCAPE_RE.sub(
+        lambda escape: (
+            bytes([int(escape.group(1), 8) & 0xFF])
+            if escape.group(1)
+            else _QUOTED_PATH_ESCAPES.get(escape.group(2), escape.group(2))
+        ),
+        raw_path[1:-1],
+    )
+
 
-    lines = diff_content.splitlines()
-    hunk_blocks = []
-    current_block_lines = []
-
-    # Flag to detect if we've passed the initial header (diff --git, index, ---, +++)
-    # and are now looking for hunk headers (@@)
-    in_hunk_section = False
-
-    for line in lines:
-        # Check for start of a new file diff or a new hunk
-        if line.startswith("diff --git "):
-            # If we've accumulated lines for a previous block, add it
-            if current_block_lines:
-                hunk_blocks.append("\n".join(current_block_lines))
-            current_block_lines = [line]
-            in_hunk_section = False  # Reset for new file header
-        elif line.startswith("@@ "):
-            # If we've accumulated lines for a previous block (header or hunk), add it
-            if current_block_lines:
-                hunk_blocks.append("\n".join(current_block_lines))
-            current_block_lines = [line]
-            in_hunk_section = True
+def _quote_git_path(path):
+    """
+    Applies Git's C-style path quoting, the counterpart of _unquote_git_path:
+    paths with special or non-ASCII bytes are escaped and put in double quotes.
+    Other paths are returned as is.
+    """
+    if _PATH_QUOTE_BYTE_RE.search(path) is None:
+        return path
+    return b'"%s"' % _PATH_QUOTE_BYTE_RE.sub(
+        lambda byte: _PATH_QUOTE_ESCAPES.get(byte.group(), b"\\%03o" % byte.group()[0]),
+        path,
+    )
+
+
+def _diff_section_path(header_paths, section):
+    """
+    Returns the b/ (new) path of one file section of a 'git diff' output,
+    or None if it cannot be told.
+    The common unquoted header is read directly; renames, copies and quoted
+    paths are resolved from the extended header lines that name the new path
+    on their own, or from the quoted b/ token of the header.
+    """
+    paths = _DIFF_HEADER_PATHS_RE.fullmatch(header_paths)
+    if paths is not None:
+        return paths.group(1)
+
+    for line in section.split(b"\n")[1:]:
+        if line.startswith(b"@@"):
+            break  # Hunks follow; the extended header is over
+        if line.startswith((b"rename to ", b"copy to ")):
+            return _unquote_git_path(line.split(b" ", 2)[2])
+        if line.startswith(b"+++ ") and line != b"+++ /dev/null":
+            new_path = _unquote_git_path(line[4:].rstrip(b"\t"))
+            if new_path.startswith(b"b/"):
+                return new_path[2:]
+
+    # Deletions and binary files have no '+++' line; use a quoted b/ token.
+    if header_paths.endswith(b'"'):
+        start = header_paths.rfind(b' "b/')
+        if start != -1:
+            return _unquote_git_path(header_paths[start + 1 :])[2:]
+    return None
+
+
+def _split_combined_diff(cfg, diff_content):
+    """
+    Splits the raw output of a repo-wide 'git diff' into per-file sections,
+    keyed by the b/ (new) path of each section so renamed files are found
+    under the path 'git status' reports. A conflicted file's '* Unmerged path'
+    notice is kept as that file's diff.
+    Returns a dict mapping each file path to its diff bytes, and a boolean
+    that is False if any section or other text could not be attributed to a
+    path, in which case the dict is incomplete.
+    """
+    file_diffs = {}
+    starts = list(_DIFF_SECTION_RE.finditer(diff_content))
+    # Text before the first section belongs to no file.
+    complete = not diff_content[: starts[0].start() if starts else None].strip()
+
+    for index, start in enumerate(starts):
+        end = (
+            starts[index + 1].start() if index + 1 < len(starts) else len(diff_content)
+        )
+        section = diff_content[start.start() : end]
+        if start.group(1) is not None:
+            section_path = _diff_section_path(start.group(1), section)
         else:
-            current_block_lines.append(line)
+            # An unmerged-path notice is the conflicted file's whole diff;
+            # any other stray text is attributed to no file.
+            section_path = start.group(2)
+        if section_path is None:
+            if cfg.debug_enabled:
+                _log_message(
+                    cfg,
+                    f"Could not attribute diff section: '{os.fsdecode(start.group(0))}'",
+                    level="debug",
+                )
+            complete = False
+            continue
+        # A type change (e.g. file to symlink) is a deletion followed by a
+        # new file, both under the same path: keep both sections.
+        fpath = os.fsdecode(section_path)
+        file_diffs[fpath] = file_diffs.get(fpath, b"") + section
 
-    # Add the last accumulated block if any
-    if current_block_lines:
-        hunk_blocks.append("\n".join(current_block_lines))
+    return file_diffs, complete
 
-    return hunk_blocks
 
+def _diff_base(cfg, repo_path):
+    """
+    Returns what tracked files are diffed against: HEAD, or the empty tree
+    while HEAD is unborn (no commit yet), where 'git diff HEAD' fails.
+    Both answers come from memoized commands, so Git is asked once per run.
+    """
+    # Prints nothing, and still succeeds, when HEAD does not resolve.
+    head, _ = _execute_git_command(cfg, ["rev-parse", "--revs-only", "HEAD"], repo_path)
+    if head.strip():
+        return "HEAD"
+    empty_tree, _ = _execute_git_command(
+        cfg, ["hash-object", "-t", "tree", "--stdin"], repo_path, input_data=b""
+    )
+    return os.fsdecode(empty_tree.strip()) or "HEAD"
 
-def create_json_output_data(all_file_diffs) -> list:
-    json_output_data = []
 
-    for fpath in sorted(all_file_diffs.keys()):  # Sort for consistent output
-        diff_info = all_file_diffs[fpath]
-        filename_base, ext = os.path.splitext(fpath)  # Get filename base and extension
+def _tracked_diff_command(cfg, repo_path, allow_all_changes, paths=()):
+    """
+    Builds the 'git diff' command for tracked files: staged changes only,
+    or staged and unstaged changes when allow_all_changes is set.
+    The output format is pinned so user diff settings cannot change it.
+    """
+    command = ["diff", *_DIFF_FORMAT_OPTIONS, _diff_base(cfg, repo_path)]
+    if not allow_all_changes:
+        command.append("--cached")
+    return command + ["--", *paths]
 
-        # Get the full raw diff text
-        full_raw_diff_text = diff_info["diff"]
 
-        json_output_data.append(
-            {
-                "filename": fpath,  # Use full path as filename
-                "ext": ext,
-                "all_diffs_as_text": full_raw_diff_text,  # Full diff as single string
-                "diff_blocks": _split_diff_into_hunks(
-                    full_raw_diff_text
-                ),  # Diff split into an array of hunk strings
-            }
+def _collect_tracked_diffs(cfg, normalized_repo_path, allow_all_changes, paths=None):
+    """
+    Runs a single repo-wide 'git diff' and splits it per file.
+    If paths is given, only those files are diffed instead, passed as literal
+    pathspecs in chunks of _PATHSPEC_CHUNK_SIZE so each command line stays
+    short: one process per chunk rather than one per file.
+    Returns the same (dict, complete) pair as _split_combined_diff, or
+    (None, False) if a 'git diff' command failed or timed out.
+    """
+    if paths is None:
+        chunks = [()]
+    else:
+        chunks = [
+            [
+                ":(literal)" + fpath
+                for fpath in paths[start : start + _PATHSPEC_CHUNK_SIZE]
+            ]
+            for start in range(0, len(paths), _PATHSPEC_CHUNK_SIZE)
+        ]
+
+    file_diffs, complete = {}, True
+    for pathspecs in chunks:
+        stdout_diff, success_diff = _execute_git_command_uncached(
+            cfg,
+            _tracked_diff_command(
+                cfg, normalized_repo_path, allow_all_changes, pathspecs
+            ),
+            cwd=normalized_repo_path,
         )
-    return json_output_data
+        if not success_diff:
+            return None, False
+        chunk_diffs, chunk_complete = _split_combined_diff(cfg, stdout_diff)
+        file_diffs.update(chunk_diffs)
+        complete = complete and chunk_complete
+    return file_diffs, complete
+
+
+def _open_pygit2_repository(cfg, repo_path):
+    """
+    Opens the repository with pygit2 when it is installed.
+    Returns None if pygit2 is unavailable or cannot open the repository,
+    in which case the git command line is used instead.
+    """
+    if pygit2 is None:
+        return None
+    try:
+        repository = pygit2.Repository(repo_path)
+    except pygit2.GitError as e:
+        if cfg.debug_enabled:
+            _log_message(
+                cfg, f"pygit2 could not open '{repo_path}': {e}", level="debug"
+            )
+        return None
+    if cfg.debug_enabled:
+        _log_message(cfg, f"Using pygit2 {pygit2.__version__} backend.", level="debug")
+    return repository
+
+
+def _pygit2_status_entries(cfg, repository, include_untracked):
+    """
+    Reads the same {"status", "path"} entries as _iter_status_entries
+    in-process with pygit2, without spawning 'git status'.
+    Untracked directories are listed file by file.
+    Returns None if libgit2 reports an error.
+    """
+    index_codes = (
+        (pygit2.GIT_STATUS_INDEX_NEW, "A"),
+        (pygit2.GIT_STATUS_INDEX_MODIFIED, "M"),
+        (pygit2.GIT_STATUS_INDEX_DELETED, "D"),
+        (pygit2.GIT_STATUS_INDEX_RENAMED, "R"),
+        (pygit2.GIT_STATUS_INDEX_TYPECHANGE, "T"),
+    )
+    worktree_codes = (
+        (pygit2.GIT_STATUS_WT_MODIFIED, "M"),
+        (pygit2.GIT_STATUS_WT_DELETED, "D"),
+        (pygit2.GIT_STATUS_WT_RENAMED, "R"),
+        (pygit2.GIT_STATUS_WT_TYPECHANGE, "T"),
+    )
+
+    try:
+        status = repository.status(untracked_files="all" if include_untracked else "no")
+    except pygit2.GitError as e:
+        if cfg.debug_enabled:
+            _log_message(cfg, f"pygit2 could not read the status: {e}", level="debug")
+        return None
+
+    changed_files_info = []
+    for fpath, flags in sorted(status.items()):
+        if flags & pygit2.GIT_STATUS_IGNORED:
+            continue
+        if flags & pygit2.GIT_STATUS_CONFLICTED:
+            status_code = "UU"
+        elif flags == pygit2.GIT_STATUS_WT_NEW:
+            status_code = "??"
+        else:
+            index_code = next((code for flag, code in index_codes if flags & flag), " ")
+            worktree_code = next(
+                (code for flag, code in worktree_codes if flags & flag), " "
+            )
+            status_code = (index_code + worktree_code).strip()
+        changed_files_info.append({"status": status_code, "path": fpath})
+
+    return changed_files_info
+
+
+def _pygit2_tracked_diffs(cfg, repository, allow_all_changes):
+    """
+    Diffs tracked files in-process with pygit2, like
+    'git diff HEAD --cached' (or 'git diff HEAD' with allow_all_changes).
+    Returns a dict mapping each path to its diff bytes and a dict mapping each
+    path to whether libgit2 found it binary, or (None, None) on failure.
+    """
+    try:
+        head_tree = repository.revparse_single("HEAD").peel(pygit2.Tree)
+        diff = head_tree.diff_to_index(repository.index)
+        if allow_all_changes:
+            diff.merge(repository.diff())  # Index to working tree
+        diff.find_similar()  # Detect renames like git diff does
+
+        file_diffs = {}
+        binaries = {}
+        for patch in diff:
+            if patch is None:
+                continue
+            fpath = patch.delta.new_file.path
+            # A type change comes as a deletion and a new file: keep both.
+            file_diffs[fpath] = file_diffs.get(fpath, b"") + patch.data
+            binaries[fpath] = binaries.get(fpath, False) or patch.delta.is_binary
+    except (pygit2.GitError, KeyError, ValueError) as e:
+        if cfg.debug_enabled:
+            _log_message(
+                cfg, f"pygit2 could not diff tracked files: {e}", level="debug"
+            )
+        return None, None
+
+    return file_diffs, binaries
+
+
+def _prefetch_file_diffs(
+    cfg,
+    executor,
+    candidate_files,
+    normalized_repo_path,
+    allow_all_changes,
+    tracked_diffs,
+    tracked_diffs_complete,
+    untracked_binaries,
+):
+    """
+    Runs the per-file work not covered by the repo-wide diff in parallel:
+    per-file 'git diff' fallbacks for tracked files missing from an incomplete
+    split, and Python-built diffs for untracked files.
+    Fallback results are added to tracked_diffs; returns a dict mapping each
+    untracked file path to its (diff, is_binary) pair, or None if a fallback
+    'git diff' failed.
+    """
+    futures = {}
+    for file_info in candidate_files:
+        fpath = file_info["path"]
+        if file_info["status"] == "??":
+            if allow_all_changes:
+                future = executor.submit(
+                    _untracked_file_diff,
+                    cfg,
+                    fpath,
+                    normalized_repo_path,
+                    untracked_binaries.get(fpath),
+                )
+                futures[future] = ("untracked", fpath)
+        elif not tracked_diffs_complete and fpath not in tracked_diffs:
+            # Fall back to a per-file diff when the repo-wide diff could not be
+            # parsed. A rename is diffed with its source, as in the repo-wide
+            # diff, so it is not shown as an addition.
+            pathspecs = [":(literal)" + fpath]
+            if "orig_path" in file_info:
+                pathspecs.append(":(literal)" + file_info["orig_path"])
+            future = executor.submit(
+                _execute_git_command_uncached,
+                cfg,
+                _tracked_diff_command(
+                    cfg, normalized_repo_path, allow_all_changes, pathspecs
+                ),
+                cwd=normalized_repo_path,
+            )
+            futures[future] = ("tracked", fpath)
+
+    untracked_diffs = {}
+    fallback_failed = False
+    for future in as_completed(futures):
+        kind, fpath = futures[future]
+        if kind == "untracked":
+            untracked_diffs[fpath] = future.result()
+            continue
+
+        stdout_diff, success_diff = future.result()
+        if success_diff and stdout_diff:
+            tracked_diffs[fpath] = stdout_diff
+        elif not success_diff:
+            _log_message(cfg, f"Could not get diff for {fpath}.", level="error")
+            fallback_failed = True
+
+    return None if fallback_failed else untracked_diffs
+
+
+def _iter_json_entries(all_file_diffs):
+    """
+    Yields the JSON output entry of each (path, diff info) pair in the given
+    order, building each one only when it is about to be emitted.
+    """
+    for fpath, diff_info in all_file_diffs:
+        _, ext = os.path.splitext(fpath)  # Get filename extension
+
+        # Decode the raw diff only now that it is emitted, without Git's
+        # trailing newline; surrogateescape keeps non-UTF-8 bytes round-trippable.
+        full_raw_diff_text = (
+            diff_info["diff"].decode("utf-8", errors="surrogateescape").rstrip("\n")
+        )
+
+        yield {
+            "filename": fpath,  # Use full path as filename
+            "ext": ext,
+            "all_diffs_as_text": full_raw_diff_text,  # Full diff as single string
+            "diff_blocks": _split_diff_into_hunks(
+                full_raw_diff_text
+            ),  # Diff split into an array of hunk strings
+        }
+
+
+def _encode_json(value, indent=False):
+    """
+    Serializes value to UTF-8 JSON bytes, compact or indented by 2 spaces,
+    with non-ASCII text left unescaped. orjson is used when it is installed.
+    Lone surrogates (undecodable diff bytes) are rejected by orjson and cannot
+    be encoded to UTF-8; the json module path turns them into the same \\udcXX
+    escapes with backslashreplace.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_INDENT_2 if indent else 0)
+        except orjson.JSONEncodeError:
+            pass
+    text = json.dumps(
+        value,
+        ensure_ascii=False,
+        indent=2 if indent else None,
+        separators=(",", ": ") if indent else (",", ":"),
+    )
+    return text.encode("utf-8", errors="backslashreplace")
+
+
+def _write_json_output(all_file_diffs, pretty=False):
+    """
+    Streams the JSON array of file entries to stdout one entry at a time,
+    so only a single file's entry is held in memory as a JSON string.
+    The array is compact, or laid out like json.dumps() with indent=2 if
+    pretty is set, and written as UTF-8 bytes, bypassing the text layer.
+    """
+    out = sys.stdout.buffer
+    sys.stdout.flush()  # Pending text output goes first
+    opening, separator, closing = (
+        (b"[\n  ", b",\n  ", b"\n]\n") if pretty else (b"[", b",", b"]\n")
+    )
+    prefix = opening
+    for entry in _iter_json_entries(all_file_diffs):
+        encoded = _encode_json(entry, indent=pretty)
+        if pretty:
+            # Strings are escaped in JSON, so every newline here is indentation.
+            encoded = encoded.replace(b"\n", b"\n  ")
+        out.write(prefix + encoded)
+        prefix = separator
+    out.write(closing if prefix is not opening else b"[]\n")
+
+
+def _write_json_lines_output(all_file_diffs):
+    """
+    Writes one compact JSON object per line (NDJSON) for each file entry, so
+    consumers can process entries without parsing an enclosing array.
+    """
+    out = sys.stdout.buffer
+    sys.stdout.flush()  # Pending text output goes first
+    for entry in _iter_json_entries(all_file_diffs):
+        out.write(_encode_json(entry) + b"\n")
 
 
 def check_and_handle_untracked_change(
-    status, normalized_repo_path, fpath, file_extensions, all_file_diffs, allow_all_changes=False
+    cfg,
+    status,
+    normalized_repo_path,
+    fpath,
+    file_extensions,
+    all_file_diffs,
+    allow_all_changes=False,
+    tracked_diffs=None,
+    untracked_diffs=None,
 ) -> None:
-    cached_files = "" if allow_all_changes else "--cached" 
     if status == "??":
         if allow_all_changes == False: return
-        full_path = os.path.join(normalized_repo_path, fpath)
-        if os.path.isdir(full_path):
-            _log_message(f"\n--- Untracked Directory: {fpath} ---", level="info")
-            dir_had_content_diff = False
-            for root, _, files in os.walk(full_path):
-                for file in files:
-                    sub_file_path_relative = os.path.relpath(
-                        os.path.join(root, file), normalized_repo_path
-                    )
+        diff, is_binary = (untracked_diffs or {}).get(fpath) or _untracked_file_diff(
+            cfg, fpath, normalized_repo_path
+        )
+        if cfg.ignore_binaries and is_binary:
+            _log_message(cfg, f"Ignoring binary file: '{fpath}'", level="info")
+        elif diff:
+            all_file_diffs.append((fpath, {"status": "Untracked", "diff": diff}))
+        elif diff is None:
+            _log_message(
+                cfg,
+                f"Could not get diff for untracked file {fpath}. Skipping.",
+                level="warning",
+            )
+    else:
+        stdout_diff = (tracked_diffs or {}).get(fpath)
+        if stdout_diff is not None:
+            all_file_diffs.append((fpath, {"status": status, "diff": stdout_diff}))
 
-                    if file_extensions:
-                        _, sub_ext = os.path.splitext(sub_file_path_relative)
-                        if sub_ext.lower() not in file_extensions:
-                            _log_message(
-                                f"Skipping untracked sub-file '{sub_file_path_relative}' due to extension filter.",
-                                level="debug",
-                            )
-                            continue
-
-                    # Apply binary ignore for sub-files too
-                    if _ignore_binaries and _is_binary_file(
-                        sub_file_path_relative, normalized_repo_path
-                    ):
-                        _log_message(
-                            f"Ignoring binary file: '{sub_file_path_relative}'",
-                            level="info",
-                        )
-                        continue
-
-                    stdout_diff_sub, success_diff_sub = _execute_git_command(
-                        ["diff", cached_files, "--no-index", "/dev/null",  sub_file_path_relative],
-                        cwd=normalized_repo_path,
-                    )
-                    if success_diff_sub and stdout_diff_sub.strip():
-                        all_file_diffs[sub_file_path_relative] = {
-                            "status": "Untracked",
-                            "diff": stdout_diff_sub.strip(),
-                        }
-                        dir_had_content_diff = True
-                    elif not success_diff_sub and _verbose:
-                        _log_message(
-                            f"Could not get diff for untracked file {sub_file_path_relative}. Skipping.",
-                            level="warning",
-                        )
-            if not dir_had_content_diff and _verbose and not _output_json:
-                _log_message(
-                    f"(No untracked files with content found in {fpath})",
-                    level="info",
-                )
-            _log_message(f"----- End Untracked Directory: {fpath} -----", level="info")
-        else:
-            stdout_diff, success_diff = _execute_git_command(
-                ["diff", "--no-index",cached_files, "/dev/null", fpath], cwd=normalized_repo_path
+
+def _quick_has_changes(cfg, repo_path, allow_all_changes, scan_untracked):
+    """
+    Tells cheaply whether there can be anything to show, before 'git status'
+    is run: 'git diff --quiet' stops at the first tracked change, and the
+    untracked-file listing is cut off after its first byte.
+    Returns False only if the tree is known to be clean; errors count as changes.
+    """
+    quiet_diff = _tracked_diff_command(cfg, repo_path, allow_all_changes)
+    quiet_diff.insert(1, "--quiet")
+    untracked_list = ["ls-files", "--others", "--exclude-standard", "-z"]
+    if cfg.debug_enabled:
+        _log_message(
+            cfg,
+            f"Executing Git command: 'git {' '.join(quiet_diff)}' in '{repo_path}'",
+            level="debug",
+        )
+
+    try:
+        returncode = subprocess.run(
+            _GIT_COMMAND + quiet_diff,
+            cwd=repo_path,
+            env=_GIT_ENV,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=cfg.timeout,
+        ).returncode
+        if returncode != 0:
+            return True  # 1 means tracked changes; errors are left to the full run
+        if not scan_untracked:
+            return False
+
+        if cfg.debug_enabled:
+            _log_message(
+                cfg,
+                f"Executing Git command: 'git {' '.join(untracked_list)}' in '{repo_path}'",
+                level="debug",
             )
-            if success_diff and stdout_diff.strip():
-                all_file_diffs[fpath] = {
-                    "status": "Untracked",
-                    "diff": stdout_diff.strip(),
-                }
-            elif not success_diff:
-                _log_message(
-                    f"Could not get diff for untracked file {fpath}. Skipping.",
-                    level="warning",
-                )
+        with subprocess.Popen(
+            _GIT_COMMAND + untracked_list,
+            cwd=repo_path,
+            env=_GIT_ENV,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ) as process:
+            timer = None
+            if cfg.timeout is not None:
+                # A killed listing fails, which counts as a change.
+                timer = threading.Timer(cfg.timeout, process.kill)
+                timer.start()
+            try:
+                if process.stdout.read(1):
+                    process.kill()  # One untracked file is enough
+                    return True
+                return process.wait() != 0
+            finally:
+                if timer is not None:
+                    timer.cancel()
+    except (OSError, subprocess.TimeoutExpired):
+        return True
+
+
+def _print_no_changes(cfg):
+    if not cfg.json:
+        print("No changes detected.")
+    elif not cfg.json_lines:  # No lines at all for an empty NDJSON stream
+        print(json.dumps([]))  # Print empty JSON array
+
+
+def _index_entry_count(cfg, repo_path):
+    """
+    Returns the number of entries in the repository's index, read from the
+    12-byte index file header ('DIRC', version, entry count) instead of
+    listing the index. Returns 0 if there is no index yet, or None if it
+    cannot be read.
+    """
+    git_dir = os.path.join(repo_path, ".git")
+    if os.path.isdir(git_dir):
+        index_path = os.path.join(git_dir, "index")
     else:
-        stdout_diff, success_diff = _execute_git_command(
-            ["diff", "HEAD" ,cached_files, "--", fpath], cwd=normalized_repo_path
+        # Worktrees and submodules keep their index in a separate Git directory.
+        stdout_path, success_path = _execute_git_command(
+            cfg, ["rev-parse", "--git-path", "index"], cwd=repo_path
         )
+        if not success_path:
+            return None
+        index_path = os.path.join(repo_path, os.fsdecode(stdout_path.strip()))
 
-        if success_diff and stdout_diff.strip():
-            all_file_diffs[fpath] = {"status": status, "diff": stdout_diff.strip()}
-        elif not success_diff:
-            _log_message(f"Could not get diff for {fpath}. Skipping.", level="warning")
+    try:
+        with open(index_path, "rb") as f:
+            header = f.read(12)
+    except FileNotFoundError:
+        return 0
+    except OSError:
+        return None
+    if len(header) < 12 or header[:4] != b"DIRC":
+        return None
+    return int.from_bytes(header[8:12], "big")
 
 
-def run_diff_logic(repo_path, file_extensions=None, filter_filename=None, allow_all_changes = True):
+def _is_work_tree_root(cfg, repo_path):
+    """
+    Returns True if repo_path is the top level of a Git working tree.
+    A '.git' directory answers this with a single stat; otherwise (worktrees
+    and submodules have a '.git' file) Git itself is asked once, and positive
+    answers are remembered for the rest of the process.
+    """
+    try:
+        if stat.S_ISDIR(os.stat(os.path.join(repo_path, ".git")).st_mode):
+            return True
+    except OSError:
+        return False  # No '.git' at all: not the top of a working tree
+    if repo_path in _WORK_TREE_ROOTS:
+        return True
+
+    # An empty prefix means repo_path is the top level, not a subdirectory.
+    prefix, success = _execute_git_command(
+        cfg, ["rev-parse", "--show-prefix"], cwd=repo_path
+    )
+    if success and not prefix.strip():
+        _WORK_TREE_ROOTS.add(repo_path)
+        return True
+    return False
+
+
+def run_diff_logic(
+    repo_path,
+    file_extensions=None,
+    filter_filename=None,
+    allow_all_changes=True,
+    jobs=None,
+    use_pygit2=False,
+    include_untracked=True,
+    max_index_files=None,
+    cfg=None,
+):
     """
     Displays the differences for all changed files (staged, unstaged, and untracked)
     in the specified Git repository, optionally filtered by file extensions,
     and organized by file. Can also ignore binary files.
 
-    If _output_json is True, prints a JSON object; otherwise, prints human-readable diffs.
+    If cfg.json is True, prints a JSON object; otherwise, prints human-readable diffs.
 
     Args:
         repo_path (str): The path to the Git repository.
-        file_extensions (list, optional): A list of file extensions (e.g., ['.py', '.js'])
-                                          to filter the diff output. If None, no filtering.
+        file_extensions (frozenset, optional): Lowercase file extensions (e.g., {'.py', '.js'})
+                                               to filter the diff output. If None, no filtering.
+        jobs (int, optional): Number of worker threads for per-file work.
+                              Defaults to min(8, CPU count).
+        use_pygit2 (bool, optional): Read status and tracked diffs with pygit2
+                                     when it is installed. Its rename, conflict
+                                     and similarity output can differ from Git's.
+                                     Defaults to False.
+        include_untracked (bool, optional): Scan for untracked files when
+                                            allow_all_changes is set. Defaults to True.
+        max_index_files (int, optional): Give up with exit code 3 if the index has more
+                                         entries than this. If None, no limit.
+        cfg (Config, optional): Output and logging options. Defaults to Config().
     """
+    if cfg is None:
+        cfg = Config()
+    _cached_git_command.cache_clear()  # Results from an earlier run may be stale
+
     normalized_repo_path = os.path.abspath(repo_path)
 
     _log_message(
+        cfg,
         f"--- Analyzing differences in repository: {normalized_repo_path} ---",
         level="info",
     )
 
-    if not os.path.exists(normalized_repo_path):
-        _log_message(
-            f"Repository path '{normalized_repo_path}' not found.", level="error"
-        )
-        return 1
+    if not _is_work_tree_root(cfg, normalized_repo_path):
+        if not os.path.exists(normalized_repo_path):
+            _log_message(
+                cfg,
+                f"Repository path '{normalized_repo_path}' not found.",
+                level="error",
+            )
+            return 1
 
-    if not os.path.isdir(os.path.join(normalized_repo_path, ".git")):
         _log_message(
+            cfg,
             f"'{normalized_repo_path}' is not a Git repository (missing .git directory).",
             level="error",
         )
         return 1
 
-    stdout_status, success_status = _execute_git_command(
-        ["status", "--porcelain"], cwd=normalized_repo_path
+    if max_index_files is not None:
+        index_files = _index_entry_count(cfg, normalized_repo_path)
+        if index_files is not None and index_files > max_index_files:
+            _log_message(
+                cfg,
+                f"Repository index has {index_files} files, more than the limit of "
+                f"{max_index_files}. Skipping diff analysis.",
+                level="error",
+            )
+            return 3  # Distinct from the exit code 1 used for failures
+
+    repository = (
+        _open_pygit2_repository(cfg, normalized_repo_path) if use_pygit2 else None
     )
-    if not success_status:
-        _log_message("Failed to get Git status. Exiting.", level="error")
-        return 1
 
-    changed_files_info = []
-    for line in stdout_status.strip().splitlines():
-        parts = line.split(None, 1)
-        if len(parts) < 2:
-            _log_message(f"Skipping malformed status line: '{line}'", level="debug")
-            continue
+    if cfg.debug_enabled:
+        many_files, _ = _execute_git_command(
+            cfg,
+            ["config", "--get", "--default=", "feature.manyFiles"],
+            cwd=normalized_repo_path,
+        )
+        if not many_files.strip():
+            _log_message(
+                cfg,
+                "Hint: 'git config feature.manyFiles true' speeds up status in large repositories.",
+                level="debug",
+            )
 
-        status_code = parts[0]
-        file_path_raw = parts[1]
+    # Untracked files are never shown without allow_all_changes, so only
+    # scan for them when they can be shown.
+    scan_untracked = allow_all_changes and include_untracked
 
-        if " -> " in file_path_raw and (
-            status_code.startswith("R") or status_code.startswith("C")
-        ):
-            file_path = file_path_raw.split(" -> ")[1].strip()
-        else:
-            file_path = file_path_raw.strip()
+    # A clean tree is the common interactive case: answer it without a
+    # status scan. pygit2 reads the status in-process, so it needs no shortcut.
+    if repository is None and not _quick_has_changes(
+        cfg, normalized_repo_path, allow_all_changes, scan_untracked
+    ):
+        _print_no_changes(cfg)
+        return 0
 
-        changed_files_info.append({"status": status_code, "path": file_path})
+    # Without a filter, the repo-wide diff does not depend on the status
+    # entries, so it runs alongside the status scan instead of after it.
+    pending_tracked_diffs = None
+    if repository is None and not (file_extensions or filter_filename):
+        diff_runner = ThreadPoolExecutor(max_workers=1)
+        pending_tracked_diffs = diff_runner.submit(
+            _collect_tracked_diffs, cfg, normalized_repo_path, allow_all_changes
+        )
+        diff_runner.shutdown(wait=False)
+
+    status_result = {}
+    changed_files_info = None
+    if repository is not None:
+        changed_files_info = _pygit2_status_entries(cfg, repository, scan_untracked)
+        status_result["success"] = changed_files_info is not None
+    if changed_files_info is None:
+        changed_files_info = _iter_status_entries(
+            cfg, normalized_repo_path, status_result, scan_untracked
+        )
 
-    if not changed_files_info:
-        if not _output_json:
-            print("No changes detected.")
-        else:
-            print(json.dumps([]))  # Print empty JSON array if no changes
-        return 0
+    if file_extensions:
+        file_extensions = frozenset(file_extensions)
 
-    all_file_diffs = {}  # Dictionary to store diffs for JSON output
+    all_file_diffs = []  # (path, diff info) pairs, in the order they were found
 
+    candidate_files = []
     for file_info in changed_files_info:
         fpath = file_info["path"]
-        status = file_info["status"]
 
-        if filter_filename and filter_filename != basename(fpath):
+        if file_info["status"] == "??" and fpath.endswith("/"):
+            # With -uall, only nested repositories are still reported as
+            # directories; their files belong to the nested repository.
+            if cfg.debug_enabled:
+                _log_message(
+                    cfg, f"Skipping nested repository '{fpath}'.", level="debug"
+                )
+            continue
+
+        # Status paths always use '/', so the file name starts after the last one.
+        name_start = fpath.rfind("/") + 1
+        if filter_filename and filter_filename != fpath[name_start:]:
             continue
 
         if file_extensions:
-            _, ext = os.path.splitext(fpath)
-            if ext.lower() not in file_extensions:
-                _log_message(
-                    f"Skipping '{fpath}' due to extension filter.", level="debug"
-                )
+            dot = fpath.rfind(".")
+            ext = fpath[dot:].lower() if dot > name_start else ""
+            if ext not in file_extensions:
+                if cfg.debug_enabled:
+                    _log_message(
+                        cfg,
+                        f"Skipping '{fpath}' due to extension filter.",
+                        level="debug",
+                    )
                 continue
 
-        # New check for binary files
-        if _ignore_binaries and _is_binary_file(fpath, normalized_repo_path):
-            _log_message(f"Ignoring binary file: '{fpath}'", level="info")
-            continue  # Skip this file
+        candidate_files.append(file_info)
 
-        check_and_handle_untracked_change(
-            status, normalized_repo_path, fpath, file_extensions, all_file_diffs, allow_all_changes=allow_all_changes
+    if not status_result.get("success"):
+        _log_message(cfg, "Failed to get Git status. Exiting.", level="error")
+        return 1
+
+    # One repo-wide diff for all tracked files instead of one process per file.
+    tracked_diffs, tracked_diffs_complete = {}, False
+    tracked_binaries = None
+    tracked_paths = []
+    for file_info in candidate_files:
+        if file_info["status"] != "??":
+            tracked_paths.append(file_info["path"])
+            if "orig_path" in file_info:
+                tracked_paths.append(file_info["orig_path"])  # For rename detection
+    # A started repo-wide diff is always awaited, so its failure is seen
+    # even when the status lists no tracked changes.
+    if tracked_paths or pending_tracked_diffs is not None:
+        if repository is not None:
+            tracked_diffs, tracked_binaries = _pygit2_tracked_diffs(
+                cfg, repository, allow_all_changes
+            )
+            tracked_diffs_complete = tracked_diffs is not None
+        if not tracked_diffs_complete and pending_tracked_diffs is not None:
+            tracked_diffs, tracked_diffs_complete = pending_tracked_diffs.result()
+        elif not tracked_diffs_complete:
+            # With a filter, only the remaining files are diffed.
+            tracked_diffs, tracked_diffs_complete = _collect_tracked_diffs(
+                cfg,
+                normalized_repo_path,
+                allow_all_changes,
+                tracked_paths if file_extensions or filter_filename else None,
+            )
+        if tracked_diffs is None:
+            # A failed or timed-out diff must not pass for a clean tree.
+            _log_message(cfg, "Failed to get Git diff. Exiting.", level="error")
+            return 1
+
+    # Attributes ('*.txt binary', '-diff') decide for untracked files first;
+    # the rest are checked while their diff is built from disk, unless their
+    # extension already marks them as binary.
+    untracked_paths = [
+        file_info["path"]
+        for file_info in candidate_files
+        if file_info["status"] == "??"
+    ]
+    untracked_binaries = (
+        _untracked_binary_attributes(cfg, untracked_paths, normalized_repo_path)
+        if allow_all_changes and untracked_paths
+        else {}
+    )
+    if untracked_binaries is None:
+        _log_message(cfg, "Failed to get Git attributes. Exiting.", level="error")
+        return 1
+
+    # Binary check for all tracked candidates at once.
+    binary_files = {}
+    if cfg.ignore_binaries and tracked_binaries is not None:
+        binary_files = dict(tracked_binaries)  # Already known from the pygit2 diff
+        # Well-known binary extensions count as binary whatever the content,
+        # as with the command line.
+        for file_info in candidate_files:
+            fpath = file_info["path"]
+            if file_info["status"] != "??" and _has_binary_extension(fpath):
+                binary_files[fpath] = True
+    elif cfg.ignore_binaries:
+        probe_paths = []
+        for file_info in candidate_files:
+            fpath = file_info["path"]
+            if file_info["status"] == "??":
+                continue
+            diff = tracked_diffs.get(fpath)
+            if diff is not None and not _has_binary_extension(fpath):
+                # Git already marked binaries in the diff it produced.
+                binary_files[fpath] = _diff_marks_binary(diff)
+            elif diff is not None or not tracked_diffs_complete:
+                # Files missing from a complete diff have nothing to show;
+                # only the per-file fallback can still produce their diff.
+                probe_paths.append(fpath)
+        probed_binaries = _classify_binaries(
+            cfg, probe_paths, normalized_repo_path, allow_all_changes
+        )
+        if probed_binaries is None:
+            _log_message(
+                cfg, "Failed to classify binary files. Exiting.", level="error"
+            )
+            return 1
+        binary_files.update(probed_binaries)
+    if cfg.ignore_binaries:
+        for fpath in untracked_paths:
+            is_binary = untracked_binaries.get(fpath)
+            if is_binary if is_binary is not None else _has_binary_extension(fpath):
+                binary_files[fpath] = True
+
+    text_files = []
+    for file_info in candidate_files:
+        if binary_files.get(file_info["path"]):
+            _log_message(
+                cfg, f"Ignoring binary file: '{file_info['path']}'", level="info"
+            )
+            continue  # Skip this file
+        text_files.append(file_info)
+
+    if jobs is None:
+        jobs = min(8, os.cpu_count() or 1)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        untracked_diffs = _prefetch_file_diffs(
+            cfg,
+            executor,
+            text_files,
+            normalized_repo_path,
+            allow_all_changes,
+            tracked_diffs,
+            tracked_diffs_complete,
+            untracked_binaries,
         )
+        if untracked_diffs is None:
+            _log_message(cfg, "Failed to get Git diff. Exiting.", level="error")
+            return 1
+
+        for file_info in text_files:
+            check_and_handle_untracked_change(
+                cfg,
+                file_info["status"],
+                normalized_repo_path,
+                file_info["path"],
+                file_extensions,
+                all_file_diffs,
+                allow_all_changes=allow_all_changes,
+                tracked_diffs=tracked_diffs,
+                untracked_diffs=untracked_diffs,
+            )
 
     if not all_file_diffs:
-        if not _output_json:
-            print("No changes detected.")
-        else:
-            print(json.dumps([]))  # Print empty JSON array
+        _print_no_changes(cfg)
     else:
-        if _output_json:
-            # Prepare the list of dictionaries for JSON output
-            json_output_data = create_json_output_data(all_file_diffs)
-            # Print the JSON array to stdout
-            print(json.dumps(json_output_data, indent=2))
+        if cfg.sort:
+            all_file_diffs.sort(key=operator.itemgetter(0))  # Consistent output
+
+        if cfg.json_lines:
+            _write_json_lines_output(all_file_diffs)
+        elif cfg.json:
+            # Stream the JSON array to stdout, one file entry at a time
+            _write_json_output(all_file_diffs, pretty=cfg.pretty)
         else:
-            # Existing human-readable output
-            sorted_files = sorted(all_file_diffs.keys())
-
-            for fpath in sorted_files:
-                diff_info = all_file_diffs[fpath]
-                status_display = diff_info["status"]
-                diff_content = diff_info["diff"]
+            # Existing human-readable output, as raw bytes in a single write
+            chunks = []
+            for fpath, diff_info in all_file_diffs:
+                chunks.append(
+                    b"\n--- %s (%s) ---\n"
+                    % (os.fsencode(fpath), diff_info["status"].encode())
+                )
+                chunks.append(diff_info["diff"])  # Already ends with a newline
+                chunks.append(b"-----\n")
 
-                print(f"\n--- {fpath} ({status_display}) ---")
-                print(diff_content)
-                print("-----")
+            sys.stdout.flush()  # Pending text output goes first
+            sys.stdout.buffer.write(b"".join(chunks))
 
         _log_message(
-            f"--- Diff analysis completed for {normalized_repo_path} ---", level="info"
+            cfg,
+            f"--- Diff analysis completed for {normalized_repo_path} ---",
+            level="info",
         )
 
     return 0
 
 
+def _positive_int(value):
+    """argparse type for options that need a whole number of at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def _non_negative_int(value):
+    """argparse type for options that need a whole number of at least 0."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be at least 0, got {number}")
+    return number
+
+
+def _positive_float(value):
+    """argparse type for options that need a number greater than 0."""
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid float value: '{value}'")
+    if not number > 0:  # Also rejects nan
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Displays all changed files (staged, unstaged, and untracked) in a Git repository."
@@ -426,20 +1587,76 @@ if __name__ == "__main__":
     parser.add_argument(
         "-j", "--json", action="store_true", help="Output the diffs in JSON format."
     )
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Indent JSON output (compact by default).",
+    )
+    parser.add_argument(
+        "--json-lines",
+        action="store_true",
+        help="Output one JSON object per file and line (NDJSON). Implies --json.",
+    )
+    parser.add_argument(
+        "--pygit2",
+        action="store_true",
+        help="Read status and diffs with pygit2 if installed (experimental: "
+        "renames, conflicts and similarity indexes may be reported differently).",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=_positive_int,
+        help="Number of parallel workers for per-file diffs (default: min(8, CPU count)).",
+    )
+    parser.add_argument(
+        "--no-untracked",
+        action="store_true",
+        help="Skip the scan for untracked files (faster on large working trees).",
+    )
+    parser.add_argument(
+        "--max-index-files",
+        type=_non_negative_int,
+        help="Exit with code 3 without diffing if the index has more files than this.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=_positive_float,
+        help="Abort any Git command that runs longer than this many seconds.",
+    )
+    parser.add_argument(
+        "--sort",
+        action="store_true",
+        help="Sort JSON output by path even when stdout is not a terminal.",
+    )
 
     args = parser.parse_args()
 
-    _verbose = args.verbose
-    _ignore_binaries = args.ignore_binaries
-    _output_json = args.json
+    cfg = Config(
+        verbose=args.verbose,
+        ignore_binaries=args.ignore_binaries,
+        json=args.json or args.json_lines,
+        json_lines=args.json_lines,
+        pretty=args.pretty,
+        # Piped JSON keeps discovery order unless --sort is given.
+        sort=args.sort or not (args.json or args.json_lines) or sys.stdout.isatty(),
+        timeout=args.timeout,
+    )
 
-    normalized_extensions = None
-    if args.extensions:
-        normalized_extensions = []
-        for ext in args.extensions:
-            if not ext.startswith("."):
-                ext = "." + ext
-            normalized_extensions.append(ext.lower())
+    # An empty set (no -e) disables the extension filter.
+    normalized_extensions = frozenset(
+        (ext if ext.startswith(".") else "." + ext).lower()
+        for ext in args.extensions or ()
+    )
 
-    exit_code = run_diff_logic(args.repo_path, normalized_extensions, args.file, args.allow_all_changes)
+    exit_code = run_diff_logic(
+        args.repo_path,
+        normalized_extensions,
+        args.file,
+        args.allow_all_changes,
+        jobs=args.jobs,
+        use_pygit2=args.pygit2,
+        include_untracked=not args.no_untracked,
+        max_index_files=args.max_index_files,
+        cfg=cfg,
+    )
     sys.exit(exit_code)